@@ -1,83 +1,444 @@
 import os
 import time
+import atexit
+import random
+import asyncio
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
-# 设置代理（如果需要）
-# HTTP/HTTPS 代理（Clash 常见端口 7890）
-if not os.getenv('HTTP_PROXY') and not os.getenv('HTTPS_PROXY'):
-    os.environ.setdefault("HTTP_PROXY", "http://127.0.0.1:7890")
-    os.environ.setdefault("HTTPS_PROXY", "http://127.0.0.1:7890")
-    os.environ.setdefault("NO_PROXY", "localhost,127.0.0.1,::1")
+
+# 进程内共享的HTTP会话：所有GeminiClient实例复用同一个连接池
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _shared_session() -> requests.Session:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            # 重试由GeminiClient自身负责，连接池不做重试
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            atexit.register(session.close)
+            _SESSION = session
+        return _SESSION
+
+
+# 环境变量未配置代理时使用的本地代理（Clash 常见端口 7890），本机地址不走代理
+_DEFAULT_PROXY = "http://127.0.0.1:7890"
+_PROXY_ENV_VARS = ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy")
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+# GeminiClient内存响应缓存的条目上限
+_MEMORY_CACHE_SIZE = 128
+
+
+# 请求体中固定不变的部分只序列化一次，每次调用只编码prompt文本
+_GENERATION_CONFIG = {"temperature": 0.3, "maxOutputTokens": 20000}
+_PAYLOAD_PREFIX = b'{"contents":[{"role":"user","parts":[{"text":'
+_PAYLOAD_SUFFIX = b'}]}],"generationConfig":' + json.dumps(_GENERATION_CONFIG).encode('utf-8') + b'}'
+
+
+class RateLimiter:
+    """
+    线程安全的自适应令牌桶限速器，rate_per_minute为每分钟允许的请求数
+
+    收到429时暂停发放令牌并将速率减半，之后每次成功请求逐步恢复到设定速率
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = max(1.0, float(rate_per_minute))
+        self.base_rate = float(rate_per_minute) / 60.0
+        self.fill_rate = self.base_rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足或处于暂停期时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def penalize(self, delay: float):
+        """服务端限流（429）：在delay秒内不再发放令牌，并将速率减半"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + delay)
+            self._tokens = 0.0
+            self._updated = max(now, self._paused_until)
+            self.fill_rate = max(self.base_rate / 8, self.fill_rate / 2)
+
+    def reward(self):
+        """请求成功：速率逐步恢复到设定值"""
+        with self._lock:
+            self.fill_rate = min(self.base_rate, self.fill_rate + self.base_rate / 10)
+
+
+class ResponseCache:
+    """
+    持久化的响应缓存（sqlite3），跨多次运行复用相同prompt的Gemini响应
+
+    键为(模型, prompt)的SHA-256，值为gzip压缩后的响应文本；
+    连接在线程间共享，读写由锁串行化
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache(k BLOB PRIMARY KEY, v BLOB)")
+        atexit.register(self.close)
+
+    @staticmethod
+    def _key(model: str, prompt: str) -> bytes:
+        return hashlib.sha256(model.encode('utf-8') + b'\0' + prompt.encode('utf-8')).digest()
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT v FROM llm_cache WHERE k=?", (self._key(model, prompt),)).fetchone()
+        return gzip.decompress(row[0]).decode('utf-8') if row else None
+
+    def set(self, model: str, prompt: str, value: str):
+        data = gzip.compress(value.encode('utf-8'), 1)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache(k, v) VALUES (?, ?)", (self._key(model, prompt), data))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
 
 class GeminiClient:
-    def __init__(self, api_key: Optional[str] = None, status_callback=None, base_url: Optional[str] = None, timeout: int = 300, max_retries: int = 3):
+    def __init__(self, api_key: Optional[str] = None, status_callback=None, base_url: Optional[str] = None, timeout: int = 300, max_retries: int = 3, cache: bool = False,
+                 max_concurrency: int = 4, rate_limit: Optional[float] = None, proxy: Optional[str] = None, cache_path: Optional[str] = None):
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("需要设置GEMINI_API_KEY环境变量")
 
         self.base_url = base_url or "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+        self.model = self.base_url.rsplit("/models/", 1)[-1].split(":", 1)[0]
+        # 批处理接口（异步执行，费用约为同步调用的一半），任务状态通过 {api_root}/batches/<id> 查询
+        self.batch_url = self.base_url.replace(":generateContent", ":batchGenerateContent")
+        self.api_root = self.base_url.split("/models/", 1)[0]
         self.headers = {
             'Content-Type': 'application/json',
             'X-goog-api-key': self.api_key
         }
         self.timeout = timeout
+        # 复用连接（keep-alive），避免每次请求重新进行TCP/TLS握手；
+        # 会话在实例间共享，API密钥等请求头随每个请求单独传入
+        self._session = _shared_session()
+        # 代理按请求传入（requests中环境变量代理优先于Session.proxies），不修改进程环境变量
+        proxy = proxy or self._default_proxy(self.base_url)
+        self.proxies = {"http": proxy, "https": proxy} if proxy else None
         self.status_callback = status_callback or (lambda *args, **kwargs: None)
         self.max_retries = max(1, int(max_retries))
+        # 响应缓存：按prompt的SHA-256精确匹配，默认关闭（评测的重复轮次需要独立采样）
+        self.cache_enabled = cache
+        # 内存缓存按LRU淘汰，最多保留_MEMORY_CACHE_SIZE条（完整记录由磁盘缓存负责）
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 指定cache_path（或GEMINI_CACHE_PATH环境变量）时，缓存同时落盘，下次运行可直接复用
+        cache_path = cache_path or os.getenv('GEMINI_CACHE_PATH')
+        self._disk_cache = ResponseCache(cache_path) if cache_path else None
+        # 并发上限与限速：Gemini低配额下并发过高会触发429
+        self._semaphore = threading.BoundedSemaphore(max(1, int(max_concurrency)))
+        # 未指定时读取GEMINI_RATE_LIMIT环境变量（每分钟请求数），均未设置则不限速
+        rate_limit = rate_limit or float(os.getenv('GEMINI_RATE_LIMIT', '0') or 0)
+        self._limiter = RateLimiter(rate_limit) if rate_limit > 0 else None
 
-    def call(self, prompt: str) -> Optional[str]:
-        payload = {
-            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-            "generationConfig": {"temperature": 0.3, "maxOutputTokens": 20000}
-        }
+    @staticmethod
+    def _default_proxy(url: str) -> Optional[str]:
+        """环境变量已配置代理或目标为本机时不使用默认代理"""
+        if any(os.getenv(name) for name in _PROXY_ENV_VARS):
+            return None
+        if urlsplit(url).hostname in _LOCAL_HOSTS:
+            return None
+        return _DEFAULT_PROXY
+
+    @staticmethod
+    def _cache_key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, text: str):
+        with self._cache_lock:
+            self._cache[key] = text
+            self._cache.move_to_end(key)
+            if len(self._cache) > _MEMORY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def call(self, prompt: str, use_cache: Optional[bool] = None) -> Optional[str]:
+        """
+        调用Gemini生成内容
+
+        Args:
+            prompt: 输入prompt
+            use_cache: 是否使用响应缓存，None表示沿用客户端的cache设置
+        """
+        if not (self.cache_enabled if use_cache is None else use_cache):
+            return self._request(prompt)
+
+        key = self._cache_key(prompt)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is None and self._disk_cache:
+            cached = self._disk_cache.get(self.model, prompt)
+            if cached is not None:
+                self._remember(key, cached)
+        if cached is not None:
+            return cached
+
+        result = self._request(prompt)
+        if result is not None:
+            self._remember(key, result)
+            if self._disk_cache:
+                self._disk_cache.set(self.model, prompt, result)
+        return result
+
+    def _request(self, prompt: str) -> Optional[str]:
+        with self._semaphore:
+            return self._post(prompt)
+
+    @staticmethod
+    def _retry_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+        """重试等待时间：优先使用服务端的Retry-After，否则指数退避并加随机抖动"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(max(0.0, float(retry_after)), 60.0)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(max(0.0, delay), 60.0)
+                except (TypeError, ValueError):
+                    pass
+        return min(2 ** attempt + random.uniform(0, 0.5), 30.0)
+
+    @staticmethod
+    def _build_payload(prompt: str) -> bytes:
+        return _PAYLOAD_PREFIX + json.dumps(prompt, ensure_ascii=False).encode('utf-8') + _PAYLOAD_SUFFIX
+
+    def _post(self, prompt: str) -> Optional[str]:
+        try:
+            payload = self._build_payload(prompt)
+        except Exception as e:
+            print(f"❌ Gemini API未知错误: {type(e).__name__}: {e}")
+            return None
 
         for attempt in range(1, self.max_retries + 1):
+            if self._limiter:
+                self._limiter.acquire()
             try:
-                response = requests.post(
+                response = self._session.post(
                     self.base_url,
                     headers=self.headers,
-                    json=payload,
+                    data=payload,
+                    proxies=self.proxies,
                     timeout=self.timeout
                 )
-                if response.status_code == 200:
-                    data = response.json()
-                    # 不打印原始响应，直接解析
-                    if 'candidates' in data and data['candidates']:
-                        content = data['candidates'][0]['content']
-                        if 'parts' in content and content['parts']:
-                            return content['parts'][0]['text']
-                        elif 'text' in content:
-                            return content['text']
-                        # 无可用内容
-                        return None
-                    else:
-                        # 响应结构异常，终止重试
-                        return None
+                if response.status_code != 200:
+                    # 只有200视为成功，其余状态码统一进入下面的错误处理
+                    raise requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+                if self._limiter:
+                    self._limiter.reward()
+                # 直接解析原始字节（json.loads自行识别UTF编码），跳过requests的文本解码
+                data = json.loads(response.content)
+            except requests.exceptions.RequestException as e:
+                # HTTP错误带有响应；超时或网络错误没有响应
+                response = e.response if isinstance(e, requests.exceptions.HTTPError) else None
+                if response is not None:
+                    # 对5xx和429（限流）进行重试；其余4xx为客户端错误不重试
+                    retryable = response.status_code == 429 or 500 <= response.status_code < 600
                 else:
-                    # 仅对5xx错误进行重试；4xx为客户端错误不重试
-                    if 500 <= response.status_code < 600 and attempt < self.max_retries:
-                        time.sleep(min(2 ** attempt, 8))
-                        continue
-                    print(f"❌ Gemini API错误: {response.status_code} - {response.text}")
-                    return None
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-                # 超时或网络错误：重试
-                if attempt < self.max_retries:
-                    time.sleep(min(2 ** attempt, 8))
+                    retryable = isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+                if retryable and attempt < self.max_retries:
+                    delay = self._retry_delay(attempt, response)
+                    if response is not None and response.status_code == 429 and self._limiter:
+                        # 由限速器统一暂停，所有线程的后续请求一起退避
+                        self._limiter.penalize(delay)
+                    else:
+                        time.sleep(delay)
                     continue
-                # 最后一次仍失败
-                print("❌ Gemini API超时或连接失败")
+                if response is not None:
+                    print(f"❌ Gemini API错误: {response.status_code} - {response.text}")
+                elif retryable:
+                    # 最后一次仍失败
+                    print("❌ Gemini API超时或连接失败")
+                else:
+                    print(f"❌ Gemini API请求异常: {type(e).__name__}: {e}")
                 return None
-            except requests.exceptions.RequestException as e:
-                print(f"❌ Gemini API请求异常: {type(e).__name__}: {e}")
+            except ValueError as e:
+                print(f"❌ Gemini API响应解析失败: {type(e).__name__}: {e}")
                 return None
             except Exception as e:
                 print(f"❌ Gemini API未知错误: {type(e).__name__}: {e}")
                 return None
 
+            # 不打印原始响应，直接解析；无可用内容或响应结构异常时返回None，不再重试
+            try:
+                candidates = data.get('candidates')
+                if not candidates:
+                    return None
+                content = candidates[0].get('content') or {}
+                parts = content.get('parts')
+                if parts:
+                    return parts[0].get('text')
+                return content.get('text')
+            except (AttributeError, KeyError, IndexError, TypeError) as e:
+                print(f"❌ Gemini API响应结构异常: {type(e).__name__}: {e}")
+                return None
+
         return None
 
+    def submit_batch(self, prompts: List[str], display_name: str = "benchmark") -> Optional[str]:
+        """
+        以内联请求的方式提交批处理任务
+
+        Returns:
+            任务名称（如 batches/xxx），提交失败返回None
+        """
+        requests_body = [
+            {
+                "request": {
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                    "generationConfig": _GENERATION_CONFIG
+                },
+                "metadata": {"key": str(i)}
+            }
+            for i, prompt in enumerate(prompts)
+        ]
+        payload = {"batch": {"display_name": display_name, "input_config": {"requests": {"requests": requests_body}}}}
+        try:
+            response = self._session.post(
+                self.batch_url,
+                headers=self.headers,
+                data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                proxies=self.proxies,
+                timeout=self.timeout
+            )
+            if response.status_code != 200:
+                print(f"❌ Gemini批处理提交失败: {response.status_code} - {response.text}")
+                return None
+            return response.json().get("name")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"❌ Gemini批处理提交异常: {type(e).__name__}: {e}")
+            return None
+
+    def get_batch(self, job_name: str) -> Optional[Dict]:
+        """查询批处理任务状态，请求失败返回None"""
+        return self._query_batch(job_name)[0]
+
+    def _query_batch(self, job_name: str) -> Tuple[Optional[Dict], Optional[int]]:
+        """查询批处理任务状态，返回(任务信息, HTTP状态码)，网络异常时状态码为None"""
+        try:
+            response = self._session.get(
+                f"{self.api_root}/{job_name}",
+                headers=self.headers,
+                proxies=self.proxies,
+                timeout=self.timeout
+            )
+            if response.status_code != 200:
+                print(f"❌ Gemini批处理查询失败: {response.status_code} - {response.text}")
+                return None, response.status_code
+            return response.json(), response.status_code
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"❌ Gemini批处理查询异常: {type(e).__name__}: {e}")
+            return None, None
+
+    @staticmethod
+    def _batch_texts(job: Dict, count: int) -> List[Optional[str]]:
+        """从已完成的批处理任务中按提交顺序取出各请求的生成文本"""
+        output = job.get("response") or job.get("metadata", {}).get("output") or {}
+        inlined = output.get("inlinedResponses", {})
+        if isinstance(inlined, dict):
+            inlined = inlined.get("inlinedResponses", [])
 
+        texts: List[Optional[str]] = [None] * count
+        for position, item in enumerate(inlined):
+            key = item.get("metadata", {}).get("key")
+            index = int(key) if key is not None and str(key).isdigit() else position
+            if not 0 <= index < count:
+                continue
+            for candidate in item.get("response", {}).get("candidates", [])[:1]:
+                parts = candidate.get("content", {}).get("parts", [])
+                if parts and parts[0].get("text"):
+                    texts[index] = parts[0]["text"]
+        return texts
+
+    def wait_batch(self, job_name: str, count: int, poll_interval: float = 30.0, max_interval: float = 300.0,
+                   max_wait: float = 86400.0, max_failures: int = 5) -> Optional[List[Optional[str]]]:
+        """
+        轮询等待批处理任务完成，轮询间隔按1.5倍递增直到max_interval
+
+        任务不存在或无权访问（4xx，429除外）、连续max_failures次查询失败、
+        或等待超过max_wait秒时放弃等待
+
+        Returns:
+            与提交顺序一致的生成文本列表（单个请求失败时对应位置为None），任务失败或放弃等待时返回None
+        """
+        deadline = time.monotonic() + max_wait
+        interval = poll_interval
+        failures = 0
+        while True:
+            job, status_code = self._query_batch(job_name)
+            if job is not None:
+                failures = 0
+                state = job.get("metadata", {}).get("state", "")
+                if state.endswith("_SUCCEEDED"):
+                    return self._batch_texts(job, count)
+                if state.endswith(("_FAILED", "_CANCELLED", "_EXPIRED")):
+                    print(f"❌ Gemini批处理任务 {job_name} 结束，状态: {state}")
+                    return None
+                print(f"⏳ 批处理任务 {job_name} 状态: {state or '未知'}")
+            elif status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                # 任务已删除/过期或API密钥无效，重试不会成功
+                print(f"❌ Gemini批处理任务 {job_name} 无法查询，放弃等待")
+                return None
+            else:
+                failures += 1
+                if failures >= max_failures:
+                    print(f"❌ Gemini批处理任务 {job_name} 连续 {failures} 次查询失败，放弃等待")
+                    return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"❌ Gemini批处理任务 {job_name} 等待超时（{max_wait:.0f}秒），放弃等待")
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, max_interval)
 
+    async def acall(self, prompt: str, use_cache: Optional[bool] = None) -> Optional[str]:
+        """call的异步版本，在线程中执行阻塞请求，不阻塞事件循环"""
+        return await asyncio.to_thread(self.call, prompt, use_cache)
 
+    async def acall_many(self, prompts: List[str]) -> List[Optional[str]]:
+        """并发发送多个prompt，返回结果顺序与输入一致（并发度受max_concurrency限制）"""
+        return await asyncio.gather(*(self.acall(p) for p in prompts))
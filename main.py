@@ -4,6 +4,8 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # 设置控制台编码为UTF-8
 if sys.platform == 'win32':
     try:
@@ -11,6 +13,7 @@ if sys.platform == 'win32':
         sys.stderr.reconfigure(encoding='utf-8')
     except:
         pass
+from llm import GeminiClient
 from pipeline.sampler import Sampler
 from pipeline.prompt import PromptGenerator
 from pipeline.preprocess import EnvironmentManager
@@ -18,6 +21,54 @@ from pipeline.inference import InferenceEngine
 from pipeline.postprocess import PostProcessor
 
 
+class _TaskOutput:
+    """
+    按线程区分任务的stdout代理：并发任务的输出按整行写到控制台，
+    每行带任务编号前缀，不同任务的行不会交错，也不会把整个任务的输出积压到结束
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def begin(self, task_id):
+        self._local.prefix = f"[{task_id}] "
+        self._local.pending = ""
+
+    def end(self):
+        pending = getattr(self._local, 'pending', "")
+        if pending:
+            self._emit(pending + "\n")
+        self._local.prefix = None
+        self._local.pending = ""
+
+    def _emit(self, text):
+        prefix = self._local.prefix
+        lines = [prefix + line if line.strip() else line for line in text.splitlines(True)]
+        with self._lock:
+            self._stream.write("".join(lines))
+            self._stream.flush()
+
+    def write(self, text):
+        if getattr(self._local, 'prefix', None) is None:
+            with self._lock:
+                return self._stream.write(text)
+        # 不完整的行先暂存，遇到换行时整行输出
+        complete, newline, rest = (self._local.pending + text).rpartition("\n")
+        self._local.pending = rest
+        if newline:
+            self._emit(complete + newline)
+        return len(text)
+
+    def flush(self):
+        if getattr(self._local, 'prefix', None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
 def main():
     """主函数"""
     print("=" * 60)
@@ -44,37 +95,77 @@ def main():
             return
 
         print(f"✅ 计划生成完成: 共 {total_tasks} 个任务，每个组合生成 {run_count} 次。")
+        max_workers = max(1, min(int(os.getenv('BENCHMARK_WORKERS', '4')), total_tasks))
 
         # 2. 初始化LLM客户端
         print("\n[2/4] 初始化LLM客户端...")
-        prompt_generator = PromptGenerator(api_key=api_key)
-        inference_engine = InferenceEngine(api_key=api_key)
-        post_processor = PostProcessor(api_key=api_key)
+        # 各阶段共用一个客户端：连接池、并发上限与限速在所有任务间统一生效
+        client = GeminiClient(api_key=api_key, max_concurrency=max_workers)
+        env_manager = EnvironmentManager()
+        # BENCHMARK_REUSE_PROMPTS=1 时同一组合的多次运行共用一个用户prompt
+        prompt_generator = PromptGenerator(client=client, cache_prompts=os.getenv('BENCHMARK_REUSE_PROMPTS') == '1')
+        inference_engine = InferenceEngine(env_manager=env_manager, client=client)
+        # BENCHMARK_FAST_EVAL=1 时一次迭代即成功的运行直接生成基础报告，不调用LLM评测
+        post_processor = PostProcessor(client=client, fast_mode=os.getenv('BENCHMARK_FAST_EVAL') == '1')
+        # BENCHMARK_BATCH_EVAL=1 时所有任务推理完成后通过Gemini批处理接口统一评测（延迟高、费用低）
+        batch_eval = os.getenv('BENCHMARK_BATCH_EVAL') == '1'
         print("✅ LLM客户端初始化完成")
 
         # 3. 预处理：检查openseespy环境
         print("\n[3/4] 检查OpenSeesPy环境...")
-        env_manager = EnvironmentManager()
         env_manager.setup_environment()
         print("✅ 环境检查完成")
 
-        # 4. 执行评测任务
-        print("\n[4/4] 开始执行评测任务...")
-        report_paths = []
-
-        for idx, (structure, intention, run_index) in enumerate(plan, start=1):
-            print("\n" + "-" * 60)
-            print(f"任务 {idx}/{total_tasks}: {structure}-{intention} (第 {run_index} 次)")
-            print("-" * 60)
+        # 4. 执行评测任务（任务以网络与子进程I/O为主，使用线程池并发执行）
+        print(f"\n[4/4] 开始执行评测任务（并发数: {max_workers}）...")
+        console = sys.stdout
+        task_output = _TaskOutput(console)
 
+        def run_task(idx, structure, intention, run_index):
+            task_output.begin(idx)
             try:
+                print("\n" + "-" * 60)
+                print(f"任务 {idx}/{total_tasks}: {structure}-{intention} (第 {run_index} 次)")
+                print("-" * 60)
                 prompt = prompt_generator.generate(intention, structure)
                 inference_result = inference_engine.run(prompt, structure, intention, run_index)
-                report_path = post_processor.evaluate(inference_result)
-                report_paths.append(report_path)
-            except Exception as task_error:
-                print(f"❌ 任务 {idx} 失败: {task_error}")
-                continue
+                if batch_eval:
+                    return inference_result
+                return post_processor.evaluate(inference_result)
+            finally:
+                task_output.end()
+
+        results = {}
+        sys.stdout = task_output
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {
+                executor.submit(run_task, idx, structure, intention, run_index): idx
+                for idx, (structure, intention, run_index) in enumerate(plan, start=1)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    results[idx] = future.result()
+                except Exception as task_error:
+                    print(f"❌ 任务 {idx} 失败: {task_error}")
+        except BaseException:
+            # 中断（如Ctrl-C）时取消尚未开始的任务，不再发起新的LLM调用
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown()
+        finally:
+            sys.stdout = console
+
+        if batch_eval and results:
+            print(f"\n📦 通过批处理接口评测 {len(results)} 个推理结果...")
+            order = sorted(results)
+            report_paths = post_processor.evaluate_offline([results[idx] for idx in order])
+            results = dict(zip(order, report_paths))
+
+        # 按计划顺序列出报告
+        report_paths = [results[idx] for idx in sorted(results)]
 
         print("\n" + "=" * 60)
         print("✅ Benchmark 完成！")
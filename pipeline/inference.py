@@ -2,67 +2,145 @@
 通过llm.py调用gemini api根据prompt编写openseespy程序，运行并迭代修改
 """
 # -*- coding: utf-8 -*-
-import sys
 import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
+import re
+import string
+import asyncio
+import hashlib
 import subprocess
 import json
-from typing import Optional, List, Dict, Tuple
-from llm import GeminiClient
-from pipeline.preprocess import EnvironmentManager
+from typing import TYPE_CHECKING, Optional, List, Dict, Set, Tuple
+from pipeline import runner
+from pipeline.translate import INTENTION_MAP, STRUCTURE_MAP, to_english
+
+if TYPE_CHECKING:
+    from llm import GeminiClient
+    from pipeline.preprocess import EnvironmentManager
+
+
+# 独占一行的markdown代码块标记，分组为语言标签（模块加载时编译一次）
+_CODE_FENCE = re.compile(r'^```[ \t]*([\w+-]*)[ \t]*$', re.MULTILINE)
+# 没有完整代码块时，去掉回复首尾残留的markdown标记
+_MD_FENCE = re.compile(r'\A```(?:python)?\s*|\s*```\Z', re.DOTALL)
+
+
+# 代码生成prompt中不变的部分（与可变内容分离，保证前缀逐字节一致）
+_GENERATE_PROMPT_PREFIX = """你是一个结构分析专家，擅长使用OpenSeesPy进行结构分析。
+
+请根据下方的用户需求，使用OpenSeesPy编写一个完整的结构分析程序。要求：
+1. 使用openseespy.opensees模块
+2. 所有注释使用中文
+3. 代码完整，可以直接运行
+4. 包含必要的模型定义、分析步骤和结果输出
+5. 确保代码语法正确
+6. 不要包含绘图、可视化、matplotlib等绘图相关的代码，只输出数值计算结果
+7. 只输出Python代码，不要包含任何解释或markdown格式
+"""
+
+_REPAIR_PROMPT_PREFIX = """你是一个结构分析专家，需要修复OpenSeesPy程序中的错误。
+
+请根据下方的用户需求、上一次的代码和运行错误信息修改代码，要求：
+1. 修复所有错误
+2. 保持代码完整可运行
+3. 所有注释使用中文
+4. 不要包含绘图、可视化、matplotlib等绘图相关的代码，只输出数值计算结果
+5. 只输出修改后的完整Python代码，不要包含任何解释或markdown格式
+"""
+
+
+# 完整的prompt模板：模块加载时构建一次，每次调用只代入可变内容
+_GENERATE_PROMPT = string.Template(_GENERATE_PROMPT_PREFIX + """
+用户需求：$prompt""")
+
+_REPAIR_PROMPT = string.Template(_REPAIR_PROMPT_PREFIX + """
+用户需求：$prompt
+
+上一次的代码：
+```python
+$previous_code
+```
+
+运行错误信息：
+$previous_error""")
+
+
+def _extract_code(text: str) -> str:
+    """
+    从LLM回复中提取Python代码：优先取标记为python的代码块，其次取无标签的代码块，
+    同类中取最长的；没有完整代码块时去掉首尾标记
+    """
+    text = text.strip()
+    if '```' not in text:
+        return text
+
+    # 按行首的标记配对代码块，代码中间出现的```不会被当作结束标记；
+    # 只记录代码块的位置，最后切片一次，不为每个代码块生成字符串
+    best = {}
+    opening = None
+    for fence in _CODE_FENCE.finditer(text):
+        if opening is None:
+            opening = fence
+            continue
+        if fence.group(1):
+            # 代码块内带标签的标记行属于代码内容
+            continue
+        tag = opening.group(1).lower()
+        kind = 'python' if tag in ('python', 'py') else ('plain' if not tag else None)
+        start, end = opening.end() + 1, max(opening.end() + 1, fence.start() - 1)
+        if kind and (kind not in best or end - start > best[kind][1] - best[kind][0]):
+            best[kind] = (start, end)
+        opening = None
+
+    span = best.get('python') or best.get('plain')
+    if span:
+        return text[span[0]:span[1]].strip()
+
+    return _MD_FENCE.sub('', text).strip()
 
 
 class InferenceEngine:
     """迭代生成和运行openseespy程序"""
     
-    # 中英文映射
-    INTENTION_MAP = {
-        "静力分析": "statics",
-        "模态分析": "modal",
-        "地震谱分析": "spectrum",
-        "时程分析": "timehistory"
-    }
+    # 中英文映射（统一定义在pipeline/translate.py）
+    INTENTION_MAP = INTENTION_MAP
+    STRUCTURE_MAP = STRUCTURE_MAP
     
-    STRUCTURE_MAP = {
-        "框架": "frame",
-        "框架结构": "frame",
-        "剪力墙": "wall",
-        "剪力墙结构": "wall",
-        "框架剪力墙": "frame-wall",
-        "框架剪力墙结构": "frame-wall"
-    }
+    # 连续生成代码失败达到该次数时提前结束迭代
+    MAX_GENERATION_FAILURES = 2
     
-    def __init__(self, api_key: Optional[str] = None, output_dir: str = "output"):
-        self.client = GeminiClient(api_key=api_key)
+    def __init__(self, api_key: Optional[str] = None, output_dir: str = "output", reuse_exec_results: bool = True,
+                 env_manager: Optional["EnvironmentManager"] = None, client: Optional["GeminiClient"] = None):
+        # 可传入共享的客户端，各阶段共用同一组并发与限速配额
+        if client is None:
+            # 延迟导入：只导入pipeline.inference（如子进程、菜单直接退出）时不加载HTTP客户端等依赖
+            from llm import GeminiClient
+            client = GeminiClient(api_key=api_key)
+        self.client = client
         self.output_dir = output_dir
-        self.env_manager = EnvironmentManager()
-        self.python_exe = None
+        # 与调用方共享环境管理器，解释器只解析一次（结果由EnvironmentManager缓存）
+        if env_manager is None:
+            from pipeline.preprocess import EnvironmentManager
+            env_manager = EnvironmentManager()
+        self.env_manager = env_manager
         self.max_iterations = 10
+        # 已成功运行过的代码（按内容哈希）及其运行结果，相同代码不再重复运行
+        self.reuse_exec_results = reuse_exec_results
+        self._exec_cache: Dict[str, Tuple[bool, Optional[str], Optional[str]]] = {}
+        # 已创建的输出目录，同一任务的后续迭代无需再调用makedirs
+        self._known_dirs: Set[str] = set()
     
     def _translate_to_english(self, structure: str, intention: str) -> Tuple[str, str]:
         """将中文结构类型和意图类型转换为英文"""
-        structure_key = structure.strip()
-        if structure_key.endswith("结构") and structure_key not in self.STRUCTURE_MAP:
-            structure_key = structure_key[:-2]
-        structure_en = self.STRUCTURE_MAP.get(structure_key, structure_key.lower().replace(" ", "-"))
-
-        intention_key = intention.strip()
-        intention_en = self.INTENTION_MAP.get(intention_key, intention_key.lower().replace(" ", "-"))
-        return structure_en, intention_en
+        return to_english(structure, intention)
     
     def _ensure_output_dir(self, folder_name: str):
         """确保输出目录存在"""
         folder_path = os.path.join(self.output_dir, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
+        if folder_path not in self._known_dirs:
+            os.makedirs(folder_path, exist_ok=True)
+            self._known_dirs.add(folder_path)
         return folder_path
     
-    def _get_python_executable(self) -> str:
-        """获取Python可执行文件路径"""
-        if self.python_exe is None:
-            self.python_exe = self.env_manager.get_python_executable()
-        return self.python_exe
-    
     def _generate_code(self, prompt: str, iteration: int, previous_code: Optional[str] = None, 
                       previous_error: Optional[str] = None) -> str:
         """
@@ -77,41 +155,15 @@ class InferenceEngine:
         Returns:
             生成的代码
         """
+        # 固定的说明放在前面、可变内容放在最后，使各次调用共享相同前缀以命中服务端prompt缓存
         if iteration == 1 or not previous_code:
             # 第一次生成
-            system_prompt = f"""你是一个结构分析专家，擅长使用OpenSeesPy进行结构分析。
-
-用户需求：{prompt}
-
-请根据用户需求，使用OpenSeesPy编写一个完整的结构分析程序。要求：
-1. 使用openseespy.opensees模块
-2. 所有注释使用中文
-3. 代码完整，可以直接运行
-4. 包含必要的模型定义、分析步骤和结果输出
-5. 确保代码语法正确
-6. 不要包含绘图、可视化、matplotlib等绘图相关的代码，只输出数值计算结果
-
-只输出Python代码，不要包含任何解释或markdown格式："""
+            system_prompt = _GENERATE_PROMPT.substitute(prompt=prompt)
         else:
             # 迭代修改
-            system_prompt = f"""你是一个结构分析专家，需要修复OpenSeesPy程序中的错误。
-
-用户需求：{prompt}
-
-上一次的代码：
-```python
-{previous_code}
-```
-
-运行错误信息：
-{previous_error}
-
-请根据错误信息修改代码，要求：
-1. 修复所有错误
-2. 保持代码完整可运行
-3. 所有注释使用中文
-4. 不要包含绘图、可视化、matplotlib等绘图相关的代码，只输出数值计算结果
-5. 只输出修改后的完整Python代码，不要包含任何解释或markdown格式："""
+            system_prompt = _REPAIR_PROMPT.substitute(
+                prompt=prompt, previous_code=previous_code, previous_error=previous_error
+            )
         
         code = self.client.call(system_prompt)
         
@@ -119,16 +171,7 @@ class InferenceEngine:
             raise RuntimeError("生成代码失败")
         
         # 清理代码（移除可能的markdown格式）
-        code = code.strip()
-        if code.startswith("```python"):
-            code = code[9:]
-        if code.startswith("```"):
-            code = code[3:]
-        if code.endswith("```"):
-            code = code[:-3]
-        code = code.strip()
-        
-        return code
+        return _extract_code(code)
     
     def _save_code(self, code: str, structure: str, intention: str, iteration: int, run_index: int) -> str:
         """
@@ -146,8 +189,16 @@ class InferenceEngine:
         filename = f"{structure_en}-{intention_en}-{run_index}-{iteration}.py"
         filepath = os.path.join(folder_path, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(code)
+        # 代码已完整在内存中，直接编码后用底层文件描述符写入，跳过文本层缓冲
+        data = code.encode('utf-8')
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        finally:
+            os.close(fd)
         
         return filepath
     
@@ -158,8 +209,15 @@ class InferenceEngine:
         Returns:
             (是否成功, 标准输出, 错误输出)
         """
-        python_exe = self._get_python_executable()
-        
+        python_exe = self.env_manager.get_python_executable()
+
+        # 目标解释器即当前解释器时，由forkserver派生子进程运行，省去解释器启动
+        if runner.can_run_in_process(python_exe):
+            try:
+                return runner.run_script(filepath, timeout=60)
+            except Exception as e:
+                print(f"⚠️  进程内运行失败，改用子进程运行: {e}")
+
         try:
             result = subprocess.run(
                 [python_exe, filepath],
@@ -188,22 +246,10 @@ class InferenceEngine:
             (是否成功, 错误信息或None)
         """
         if success:
-            # 即使返回码为0，也通过LLM确认是否真的成功
-            analysis_prompt = f"""请分析以下OpenSeesPy程序的运行结果，判断程序是否成功执行。
-
-标准输出：
-{stdout if stdout else "无输出"}
-
-错误输出：
-{stderr if stderr else "无错误"}
-
-请判断：
-1. 程序是否成功执行？
-2. 如果失败，请说明失败原因
+            # 返回码为0即视为成功，无需再请LLM确认
+            return True, None
 
-只回答"成功"或"失败：原因"，不要其他解释："""
-        else:
-            analysis_prompt = f"""请分析以下OpenSeesPy程序的运行错误：
+        analysis_prompt = f"""请分析以下OpenSeesPy程序的运行错误：
 
 标准输出：
 {stdout if stdout else "无输出"}
@@ -213,7 +259,8 @@ class InferenceEngine:
 
 请提取关键错误信息，用于修复代码。只输出错误原因，不要其他解释："""
         
-        analysis = self.client.call(analysis_prompt)
+        # 相同运行输出的分析结论是确定的，允许使用响应缓存
+        analysis = self.client.call(analysis_prompt, use_cache=True)
         
         if not analysis:
             # 如果LLM分析失败，使用简单的判断
@@ -221,7 +268,7 @@ class InferenceEngine:
         
         analysis = analysis.strip()
         
-        if "成功" in analysis or success:
+        if "成功" in analysis:
             return True, None
         else:
             return False, analysis or stderr
@@ -245,26 +292,44 @@ class InferenceEngine:
         previous_code = None
         previous_error = None
         iterations_info = []
+        generation_failures = 0
+        # 本任务内各版本代码（按内容哈希）的运行与分析结果
+        task_outcomes: Dict[str, Tuple[bool, Optional[str], Optional[str], bool, Optional[str]]] = {}
         
         for iteration in range(1, self.max_iterations + 1):
             print(f"\n--- 迭代 {iteration}/{self.max_iterations} ---")
             
+            code = None
             try:
                 # 生成代码
                 print("正在生成代码...")
                 code = self._generate_code(prompt, iteration, previous_code, previous_error)
+                generation_failures = 0
                 
                 # 保存代码
                 filepath = self._save_code(code, structure, intention, iteration, run_index)
                 print(f"代码已保存: {filepath}")
                 
                 # 运行代码
-                print("正在运行代码...")
-                success, stdout, stderr = self._run_code(filepath)
-                
-                # 分析结果
-                print("正在分析运行结果...")
-                is_success, error_info = self._analyze_result(success, stdout, stderr)
+                code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+                if code_hash in task_outcomes:
+                    # 本任务中已运行并分析过相同代码（包括失败的），直接复用结果
+                    print("代码与本任务之前的某次迭代相同，复用运行与分析结果")
+                    success, stdout, stderr, is_success, error_info = task_outcomes[code_hash]
+                else:
+                    if self.reuse_exec_results and code_hash in self._exec_cache:
+                        print("代码与之前成功运行的代码相同，复用运行结果")
+                        success, stdout, stderr = self._exec_cache[code_hash]
+                    else:
+                        print("正在运行代码...")
+                        success, stdout, stderr = self._run_code(filepath)
+                        if success and self.reuse_exec_results:
+                            self._exec_cache[code_hash] = (success, stdout, stderr)
+                    
+                    # 分析结果
+                    print("正在分析运行结果...")
+                    is_success, error_info = self._analyze_result(success, stdout, stderr)
+                    task_outcomes[code_hash] = (success, stdout, stderr, is_success, error_info)
                 
                 iteration_info = {
                     "iteration": iteration,
@@ -300,7 +365,17 @@ class InferenceEngine:
                 }
                 iterations_info.append(iteration_info)
 
-                previous_error = str(e)
+                if code is not None:
+                    # 代码已生成但保存/运行时出错，作为错误信息用于下一次修改
+                    previous_code = code
+                    previous_error = str(e)
+                else:
+                    # 生成失败（网络错误在GeminiClient内已重试过）时保留上一次的运行错误，
+                    # 连续失败说明接口不可用，不再消耗剩余的迭代次数
+                    generation_failures += 1
+                    if generation_failures >= self.MAX_GENERATION_FAILURES:
+                        print(f"连续 {generation_failures} 次生成代码失败，停止迭代")
+                        break
 
                 if iteration < self.max_iterations:
                     print("将在下一次迭代中重试生成代码...")
@@ -319,3 +394,6 @@ class InferenceEngine:
         
         return result
 
+    async def arun(self, prompt: str, structure: str, intention: str, run_index: int) -> Dict:
+        """run的异步版本，可用asyncio.gather同时驱动多个结构-意图组合"""
+        return await asyncio.to_thread(self.run, prompt, structure, intention, run_index)
@@ -2,62 +2,114 @@
 根据评测规则，通过llm.py调用gemini api对结构分析助手的迭代编程表现进行评测
 """
 # -*- coding: utf-8 -*-
-import sys
 import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from llm import GeminiClient
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 import json
+from pipeline.translate import INTENTION_MAP, STRUCTURE_MAP, to_english
+
+
+# 评测prompt中固定的评分要求放在最前面、可变的推理过程放在最后，
+# 单次评测与批量评测共享逐字节相同的前缀，便于服务端复用prompt缓存
+_EVALUATION_PREFIX = """请对结构分析助手的迭代编程表现进行评测，并生成一份详细的评测报告，包括：
+1. 任务完成情况评估
+2. 代码质量分析
+3. 迭代过程分析
+4. 错误处理能力评估
+5. 改进建议
+6. 综合评分（0-100分）
+
+报告使用Markdown格式，标题清晰，内容详细。
+
+"""
+
+# 报告文件头部模板与控制台分隔线
+_REPORT_HEADER = (
+    "# 结构分析助手评测报告\n\n"
+    "**结构类型**: {structure}\n\n"
+    "**分析类型**: {intention}\n\n"
+    "**用户需求**: {prompt}\n\n"
+    "**最终结果**: {final_result}\n\n"
+    "**评测轮次**: 第 {run_index} 次\n\n"
+    "**总迭代次数**: {iteration_count}\n\n"
+    "---\n\n"
+)
+_BANNER = "=" * 60
+
+
+def _clip(text: str, limit: int = 500) -> str:
+    """截断过长的文本，未超长时原样返回（不复制）"""
+    return text if len(text) <= limit else text[:limit] + "..."
 
 
 class PostProcessor:
     """生成评测报告"""
     
-    # 中英文映射
-    INTENTION_MAP = {
-        "静力分析": "statics",
-        "模态分析": "modal",
-        "地震谱分析": "spectrum",
-        "时程分析": "timehistory"
-    }
+    # 中英文映射（统一定义在pipeline/translate.py）
+    INTENTION_MAP = INTENTION_MAP
+    STRUCTURE_MAP = STRUCTURE_MAP
     
-    STRUCTURE_MAP = {
-        "框架": "frame",
-        "框架结构": "frame",
-        "剪力墙": "wall",
-        "剪力墙结构": "wall",
-        "框架剪力墙": "frame-wall",
-        "框架剪力墙结构": "frame-wall"
-    }
-    
-    def __init__(self, api_key: Optional[str] = None, output_dir: str = "output"):
-        self.client = GeminiClient(api_key=api_key)
+    def __init__(self, api_key: Optional[str] = None, output_dir: str = "output", cache_dir: Optional[str] = None,
+                 client: Optional[GeminiClient] = None, fast_mode: bool = False):
+        # 可传入共享的客户端，各阶段共用同一组并发与限速配额
+        self.client = client or GeminiClient(api_key=api_key)
         self.output_dir = output_dir
         self.report_dir = os.path.join(output_dir, "report")
         os.makedirs(self.report_dir, exist_ok=True)
+        # 评测结果缓存：相同的推理结果直接复用之前LLM生成的报告内容。
+        # 默认关闭：推理结果包含LLM生成的需求和代码，正常流程中几乎不会重复，
+        # 只有指定cache_dir时才启用（如对同一批推理结果重复评测）
+        self.cache_dir = cache_dir
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        # 进行中的批处理任务，程序中断后重新运行可继续等待并取回结果
+        self.batch_state_path = os.path.join(output_dir, "batch_jobs.json")
+        # 快速模式：一次迭代即成功的运行没有可分析的内容，直接生成基础报告，不调用LLM
+        self.fast_mode = fast_mode
     
     def _translate_to_english(self, structure: str, intention: str) -> Tuple[str, str]:
         """将中文结构类型和意图类型转换为英文"""
-        structure_key = structure.strip()
-        if structure_key.endswith("结构") and structure_key not in self.STRUCTURE_MAP:
-            structure_key = structure_key[:-2]
-        structure_en = self.STRUCTURE_MAP.get(structure_key, structure_key.lower().replace(" ", "-"))
-
-        intention_key = intention.strip()
-        intention_en = self.INTENTION_MAP.get(intention_key, intention_key.lower().replace(" ", "-"))
-        return structure_en, intention_en
+        return to_english(structure, intention)
     
-    def evaluate(self, inference_result: Dict) -> str:
-        """
-        评测推理结果并生成报告
-        
-        Args:
-            inference_result: inference.py返回的结果字典
-        
-        Returns:
-            报告文件路径
-        """
+    def _cache_path(self, inference_result: Dict) -> str:
+        canonical = json.dumps(inference_result, sort_keys=True, ensure_ascii=False, default=str)
+        key = hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.md")
+
+    def _is_trivial(self, inference_result: Dict) -> bool:
+        return self.fast_mode and inference_result["final_success"] and len(inference_result["iterations"]) == 1
+
+    def _load_cached_report(self, inference_result: Dict) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(inference_result), 'r', encoding='utf-8') as f:
+                return f.read() or None
+        except FileNotFoundError:
+            return None
+
+    def _store_cached_report(self, inference_result: Dict, report_content: str):
+        if not self.cache_dir:
+            return
+        # 与报告文件相同，先写临时文件再原子替换，中途退出时不会留下半份缓存
+        cache_path = self._cache_path(inference_result)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(report_content)
+        os.replace(tmp_path, cache_path)
+
+    def clear_cache(self):
+        """清空评测结果缓存"""
+        if not self.cache_dir:
+            return
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def _describe_result(self, inference_result: Dict) -> str:
+        """评测prompt中描述单次推理结果的部分"""
         structure = inference_result["structure"]
         intention = inference_result["intention"]
         prompt = inference_result["prompt"]
@@ -65,70 +117,187 @@ class PostProcessor:
         final_success = inference_result["final_success"]
         run_index = inference_result.get("run_index", 1)
         
-        # 构建评测prompt
-        evaluation_prompt = f"""请对结构分析助手的迭代编程表现进行评测。
-
-用户需求：{prompt}
+        parts = [f"""用户需求：{prompt}
 结构类型：{structure}
 分析类型：{intention}
 评测轮次：第{run_index}次
 
 迭代过程：
-"""
+"""]
         
         for iter_info in iterations:
-            evaluation_prompt += f"""
+            parts.append(f"""
 迭代 {iter_info['iteration']}:
 - 文件路径: {iter_info.get('filepath', 'N/A')}
 - 是否成功: {'是' if iter_info.get('success') else '否'}
-"""
+""")
             if iter_info.get('error_info'):
-                evaluation_prompt += f"- 错误信息: {iter_info['error_info']}\n"
+                parts.append(f"- 错误信息: {iter_info['error_info']}\n")
             if iter_info.get('stdout'):
-                evaluation_prompt += f"- 标准输出: {iter_info['stdout'][:500]}...\n"
+                parts.append(f"- 标准输出: {_clip(iter_info['stdout'])}\n")
         
-        evaluation_prompt += f"""
+        parts.append(f"""
 最终结果: {'成功' if final_success else '失败'}
 总迭代次数: {len(iterations)}
+""")
+        return "".join(parts)
 
-请生成一份详细的评测报告，包括：
-1. 任务完成情况评估
-2. 代码质量分析
-3. 迭代过程分析
-4. 错误处理能力评估
-5. 改进建议
-6. 综合评分（0-100分）
-
-报告使用Markdown格式，标题清晰，内容详细："""
-
-        report_content = self.client.call(evaluation_prompt)
-        
-        if not report_content:
-            # 如果LLM生成失败，生成基础报告
-            report_content = self._generate_basic_report(inference_result)
+    def _write_report(self, inference_result: Dict, report_content: str) -> str:
+        """保存报告（使用英文名称），返回报告文件路径"""
+        structure = inference_result["structure"]
+        intention = inference_result["intention"]
+        prompt = inference_result["prompt"]
+        iterations = inference_result["iterations"]
+        final_success = inference_result["final_success"]
+        run_index = inference_result.get("run_index", 1)
         
-        # 保存报告（使用英文名称）
         structure_en, intention_en = self._translate_to_english(structure, intention)
         report_name = f"{structure_en}-{intention_en}-{run_index}.md"
         report_path = os.path.join(self.report_dir, report_name)
         
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(f"# 结构分析助手评测报告\n\n")
-            f.write(f"**结构类型**: {structure}\n\n")
-            f.write(f"**分析类型**: {intention}\n\n")
-            f.write(f"**用户需求**: {prompt}\n\n")
-            f.write(f"**最终结果**: {'✅ 成功' if final_success else '❌ 失败'}\n\n")
-            f.write(f"**评测轮次**: 第 {run_index} 次\n\n")
-            f.write(f"**总迭代次数**: {len(iterations)}\n\n")
-            f.write("---\n\n")
-            f.write(report_content)
-        
-        print(f"\n{'='*60}")
-        print(f"评测报告已生成: {report_path}")
-        print(f"{'='*60}\n")
+        header = _REPORT_HEADER.format(
+            structure=structure,
+            intention=intention,
+            prompt=prompt,
+            final_result='✅ 成功' if final_success else '❌ 失败',
+            run_index=run_index,
+            iteration_count=len(iterations)
+        )
+        # 先完整写入临时文件再原子替换，进程中途退出时不会留下半份报告
+        tmp_path = report_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+            f.write(header + report_content)
+        os.replace(tmp_path, report_path)
         
         return report_path
     
+    def _evaluation_prompt(self, inference_result: Dict) -> str:
+        return _EVALUATION_PREFIX + "待评测的迭代过程如下：\n\n" + self._describe_result(inference_result)
+    
+    def evaluate(self, inference_result: Dict) -> str:
+        """
+        评测推理结果并生成报告
+        
+        Args:
+            inference_result: inference.py返回的结果字典
+        
+        Returns:
+            报告文件路径
+        """
+        if self._is_trivial(inference_result):
+            report_content = self._generate_basic_report(inference_result)
+        else:
+            report_content = self._load_cached_report(inference_result)
+            if report_content:
+                print("♻️ 推理结果与之前评测过的相同，复用缓存的评测报告")
+            else:
+                report_content = self.client.call(self._evaluation_prompt(inference_result))
+                if report_content:
+                    self._store_cached_report(inference_result, report_content)
+                else:
+                    # 如果LLM生成失败，生成基础报告
+                    report_content = self._generate_basic_report(inference_result)
+        
+        report_path = self._write_report(inference_result, report_content)
+        
+        print(f"\n{_BANNER}\n评测报告已生成: {report_path}\n{_BANNER}\n")
+        
+        return report_path
+
+    def evaluate_parallel(self, inference_results: List[Dict], max_workers: int = 16) -> List[str]:
+        """
+        在线程池中并发评测多个推理结果
+
+        请求速率由GeminiClient的并发上限和限速器（GEMINI_RATE_LIMIT）控制
+
+        Returns:
+            报告文件路径列表，顺序与输入一致
+        """
+        if not inference_results:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(inference_results)))) as executor:
+            return list(executor.map(self.evaluate, inference_results))
+
+    def _load_batch_jobs(self) -> Dict[str, Dict]:
+        try:
+            with open(self.batch_state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            print(f"⚠️ 批处理状态文件损坏，已忽略: {self.batch_state_path}")
+            return {}
+
+    def _save_batch_jobs(self, jobs: Dict[str, Dict]):
+        tmp_path = self.batch_state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(jobs, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.batch_state_path)
+
+    def _finish_batch_job(self, job_name: str, inference_results: List[Dict], jobs: Dict[str, Dict], poll_interval: float,
+                          max_wait: float) -> List[str]:
+        """
+        等待批处理任务完成并写出报告，任务失败或缺少结果时改为逐个同步评测
+
+        任务失败、已不存在或等待超时时同样从状态文件中移除，避免之后的运行反复等待
+        """
+        texts = self.client.wait_batch(job_name, len(inference_results), poll_interval=poll_interval, max_wait=max_wait)
+        if texts is None:
+            texts = [None] * len(inference_results)
+
+        report_paths = []
+        for inference_result, report_content in zip(inference_results, texts):
+            if not report_content:
+                report_paths.append(self.evaluate(inference_result))
+                continue
+            self._store_cached_report(inference_result, report_content)
+            report_path = self._write_report(inference_result, report_content)
+            print(f"评测报告已生成: {report_path}")
+            report_paths.append(report_path)
+
+        jobs.pop(job_name, None)
+        self._save_batch_jobs(jobs)
+        return report_paths
+
+    def evaluate_offline(self, inference_results: List[Dict], poll_interval: float = 30.0, max_wait: float = 86400.0) -> List[str]:
+        """
+        通过Gemini批处理接口评测（适合不关心延迟的离线评测，费用更低）
+
+        先完成上次中断时仍在进行的批处理任务，再为未缓存的结果提交新任务并等待完成
+
+        Returns:
+            报告文件路径列表，顺序与输入一致
+        """
+        jobs = self._load_batch_jobs()
+        for job_name, job in list(jobs.items()):
+            print(f"⏳ 继续等待未完成的批处理任务: {job_name}")
+            self._finish_batch_job(job_name, job["inference_results"], jobs, poll_interval, max_wait)
+
+        report_paths: List[Optional[str]] = [None] * len(inference_results)
+        pending = []
+        for index, inference_result in enumerate(inference_results):
+            if self._is_trivial(inference_result) or self._load_cached_report(inference_result) is not None:
+                report_paths[index] = self.evaluate(inference_result)
+            else:
+                pending.append(index)
+        if not pending:
+            return report_paths
+
+        pending_results = [inference_results[index] for index in pending]
+        job_name = self.client.submit_batch([self._evaluation_prompt(r) for r in pending_results])
+        if job_name is None:
+            print("⚠️ 批处理提交失败，改为并发同步评测")
+            paths = self.evaluate_parallel(pending_results)
+        else:
+            print(f"📦 已提交批处理任务: {job_name}（{len(pending_results)} 个评测）")
+            jobs[job_name] = {"inference_results": pending_results}
+            self._save_batch_jobs(jobs)
+            paths = self._finish_batch_job(job_name, pending_results, jobs, poll_interval, max_wait)
+
+        for index, path in zip(pending, paths):
+            report_paths[index] = path
+        return report_paths
+
     def _generate_basic_report(self, inference_result: Dict) -> str:
         """生成基础报告（当LLM生成失败时使用）"""
         structure = inference_result["structure"]
@@ -137,7 +306,7 @@ class PostProcessor:
         final_success = inference_result["final_success"]
         run_index = inference_result.get("run_index", 1)
         
-        report = f"""## 评测结果
+        parts = [f"""## 评测结果
 
 ### 任务完成情况
 - **最终状态**: {'成功' if final_success else '失败'}
@@ -145,22 +314,22 @@ class PostProcessor:
 - **评测轮次**: 第 {run_index} 次
 
 ### 迭代过程
-"""
+"""]
         
         for iter_info in iterations:
-            report += f"""
+            parts.append(f"""
 #### 迭代 {iter_info['iteration']}
 - **状态**: {'成功' if iter_info.get('success') else '失败'}
 - **文件**: {iter_info.get('filepath', 'N/A')}
-"""
+""")
             if iter_info.get('error_info'):
-                report += f"- **错误**: {iter_info['error_info']}\n"
+                parts.append(f"- **错误**: {iter_info['error_info']}\n")
         
-        report += f"""
+        parts.append(f"""
 ### 综合评分
 - **完成度**: {100 if final_success else len(iterations) * 10}分
 - **迭代效率**: {100 // len(iterations) if iterations else 0}分
-"""
+""")
         
-        return report
+        return "".join(parts)
 
@@ -1,14 +1,64 @@
 import os
+import sys
+import shutil
 import subprocess
-from typing import Optional
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+# pip install的公共参数：跳过版本检查与交互提示，优先使用预编译wheel避免源码编译
+_PIP_INSTALL_FLAGS = ['--disable-pip-version-check', '--no-input', '--prefer-binary']
+
+# 虚拟环境目录下README.txt的内容
+_USAGE_TEXT = """OpenSees虚拟环境使用说明
+
+激活虚拟环境:
+  Linux/Mac: source opensees_venv/bin/activate
+  Windows:   opensees_venv\\Scripts\\activate.bat
+
+在虚拟环境中使用Python:
+  ./opensees_venv/bin/python  (Linux/Mac)
+  .\\opensees_venv\\Scripts\\python.exe  (Windows)
+
+已安装的包:
+  - openseespy: OpenSees的Python接口(如果兼容)
+  - numpy: 数值计算
+  - matplotlib: 绘图
+  - scipy: 科学计算
+
+注意:
+- 系统会自动检测最兼容的Python环境
+- 如果openseespy不兼容，会自动fallback到subprocess调用
+- 云部署时请确保OpenSees可执行文件在PATH中
+"""
 
 
 class EnvironmentManager:
     """管理OpenSees虚拟环境和Python环境"""
     
+    # 按优先级排列的候选Python环境
+    PYTHON_CANDIDATES = [
+        'python',      # 可能是conda/miniconda/pyenv
+        'python3',     # 系统Python3
+        '/usr/bin/python3',  # 系统默认Python3
+        '/opt/homebrew/bin/python3',  # Homebrew Python (ARM64 Mac)
+        '/usr/local/bin/python3',     # Homebrew Python (Intel Mac)
+    ]
+    
     def __init__(self, venv_dir: str = "./opensees_venv", status_callback=None):
         self.venv_dir = venv_dir
+        # 虚拟环境中Python的路径只与venv_dir和平台有关，计算一次
+        if os.name == 'nt':  # Windows
+            self._venv_python = os.path.join(venv_dir, 'Scripts', 'python.exe')
+        else:  # Unix/Linux/Mac
+            self._venv_python = os.path.join(venv_dir, 'bin', 'python')
         self.status_callback = status_callback or print
+        # openseespy兼容性探测结果缓存，避免重复启动Python子进程
+        self._compat_cache: Dict[str, bool] = {}
+        self._python_executable: Optional[str] = None
+        self._resolve_lock = threading.Lock()
 
     def setup_environment(self):
         """设置虚拟环境和必要包 - 云部署友好版本"""
@@ -34,27 +84,39 @@ class EnvironmentManager:
 
     def _find_working_openseespy_environment(self) -> bool:
         """查找已有的可用openseespy环境"""
-        python_candidates = [
-            'python',      # conda/miniconda/pyenv
-            'python3',     # 系统Python3
-        ]
-
-        for python_exe in python_candidates:
-            if self._test_openseespy_compatibility(python_exe):
-                self.status_callback(f"✅ 发现可用环境: {python_exe}")
-                return True
+        python_exe = self._first_compatible(self.PYTHON_CANDIDATES)
+        if python_exe:
+            self.status_callback(f"✅ 发现可用环境: {python_exe}")
+            return True
         return False
 
+    def _first_compatible(self, candidates: List[str]) -> Optional[str]:
+        """并发探测候选Python环境，按候选顺序（优先级）返回第一个兼容openseespy的"""
+        # 指向同一个解释器的候选（如python与python3）只探测一次
+        unique: Dict[str, str] = {}
+        for candidate in candidates:
+            unique.setdefault(self._resolve_interpreter(candidate), candidate)
+        candidates = list(unique.values())
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates))
+        try:
+            futures = [executor.submit(self._test_openseespy_compatibility, c) for c in candidates]
+            for candidate, future in zip(candidates, futures):
+                if future.result():
+                    return candidate
+            return None
+        finally:
+            # 已找到结果时不再等待其余探测
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def _get_venv_python_path(self) -> Optional[str]:
         """获取虚拟环境Python路径"""
-        if os.name == 'nt':  # Windows
-            return os.path.join(self.venv_dir, 'Scripts', 'python.exe')
-        else:  # Unix/Linux/Mac
-            return os.path.join(self.venv_dir, 'bin', 'python')
+        return self._venv_python
 
     def _create_virtual_environment(self):
         """创建虚拟环境"""
         self.status_callback(f"📦 创建虚拟环境: {self.venv_dir}")
+        self._python_executable = None
 
         try:
             # 尝试多种Python命令创建虚拟环境
@@ -62,9 +124,11 @@ class EnvironmentManager:
 
             for python_cmd in python_commands:
                 try:
+                    # 输出未被使用，直接丢弃而不经管道读取
                     subprocess.run([
                         python_cmd, '-m', 'venv', self.venv_dir
-                    ], check=True, capture_output=True)
+                    ], check=True, stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                     self.status_callback("✅ 虚拟环境创建成功")
                     break
                 except (subprocess.CalledProcessError, FileNotFoundError):
@@ -81,9 +145,7 @@ class EnvironmentManager:
 
             # 升级pip
             self.status_callback("⬆️  升级pip...")
-            subprocess.run([
-                python_path, '-m', 'pip', 'install', '--upgrade', 'pip'
-            ], check=True, capture_output=True)
+            self._run_pip([python_path, '-m', 'pip', 'install', *_PIP_INSTALL_FLAGS, '--upgrade', 'pip'])
 
             # 尝试多种方式安装openseespy
             self._install_openseespy_packages(python_path, pip_path)
@@ -102,106 +164,130 @@ class EnvironmentManager:
         """尝试多种方式安装openseespy"""
         packages = ['numpy', 'matplotlib', 'scipy']  # 基础包
 
-        # 安装基础包
+        # 安装基础包：先用一次pip调用安装全部，失败时再逐个安装以找出失败的包
         self.status_callback("📥 安装基础包...")
-        for package in packages:
-            try:
-                subprocess.run([
-                    pip_path, 'install', package
-                ], check=True, capture_output=True)
-                self.status_callback(f"    ✅ {package} 安装成功")
-            except subprocess.CalledProcessError:
-                self.status_callback(f"    ⚠️  {package} 安装失败，但继续执行...")
+        try:
+            self._run_pip([pip_path, 'install', *_PIP_INSTALL_FLAGS, *packages])
+            self.status_callback(f"    ✅ {', '.join(packages)} 安装成功")
+        except subprocess.CalledProcessError:
+            for package in packages:
+                try:
+                    self._run_pip([pip_path, 'install', *_PIP_INSTALL_FLAGS, package])
+                    self.status_callback(f"    ✅ {package} 安装成功")
+                except subprocess.CalledProcessError as e:
+                    self.status_callback(f"    ⚠️  {package} 安装失败，但继续执行...")
+                    self._report_pip_error(e)
 
         # 尝试安装openseespy
         self.status_callback("📥 尝试安装openseespy...")
         opensees_install_methods = [
             # 方法1: 标准pip安装
-            [pip_path, 'install', 'openseespy'],
+            [pip_path, 'install', *_PIP_INSTALL_FLAGS, 'openseespy'],
             # 方法2: 强制重新安装
-            [pip_path, 'install', '--force-reinstall', '--no-cache-dir', 'openseespy'],
+            [pip_path, 'install', *_PIP_INSTALL_FLAGS, '--force-reinstall', '--no-cache-dir', 'openseespy'],
             # 方法3: 指定索引
-            [pip_path, 'install', '-i', 'https://pypi.org/simple/', 'openseespy'],
+            [pip_path, 'install', *_PIP_INSTALL_FLAGS, '-i', 'https://pypi.org/simple/', 'openseespy'],
         ]
 
         for method in opensees_install_methods:
             try:
-                subprocess.run(method, check=True, capture_output=True)
-                # 测试安装是否成功
-                if self._test_openseespy_compatibility(python_path):
+                self._run_pip(method)
+                # 测试安装是否成功（安装后需重新探测，不能使用缓存）
+                if self._test_openseespy_compatibility(python_path, refresh=True):
                     self.status_callback("✅ openseespy安装并测试成功")
                     return
                 else:
                     self.status_callback("⚠️  openseespy安装成功但测试失败，尝试下一种方法...")
-            except subprocess.CalledProcessError:
+            except subprocess.CalledProcessError as e:
                 self.status_callback("⚠️  当前安装方法失败，尝试下一种...")
+                self._report_pip_error(e)
                 continue
 
         self.status_callback("⚠️  所有openseespy安装方法都失败，将依赖subprocess fallback")
 
+    def _run_pip(self, cmd: List[str]):
+        """运行pip命令：不接收终端输入，标准输出直接丢弃，只保留stderr供失败时诊断"""
+        subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def _report_pip_error(self, error: subprocess.CalledProcessError):
+        """输出pip失败时stderr的最后几行"""
+        if error.stderr:
+            lines = error.stderr.decode(errors='replace').strip().splitlines()
+            for line in lines[-5:]:
+                self.status_callback(f"      {line}")
+
     def _create_usage_file(self):
         """创建使用说明文件"""
         usage_file = os.path.join(self.venv_dir, "README.txt")
+        # 说明文件内容固定，重复运行setup时内容未变就不再重写
+        try:
+            with open(usage_file, 'r', encoding='utf-8') as f:
+                if f.read() == _USAGE_TEXT:
+                    return
+        except (OSError, UnicodeDecodeError):
+            pass
         with open(usage_file, 'w', encoding='utf-8') as f:
-            f.write("""OpenSees虚拟环境使用说明
-
-激活虚拟环境:
-  Linux/Mac: source opensees_venv/bin/activate
-  Windows:   opensees_venv\\Scripts\\activate.bat
-
-在虚拟环境中使用Python:
-  ./opensees_venv/bin/python  (Linux/Mac)
-  .\\opensees_venv\\Scripts\\python.exe  (Windows)
-
-已安装的包:
-  - openseespy: OpenSees的Python接口(如果兼容)
-  - numpy: 数值计算
-  - matplotlib: 绘图
-  - scipy: 科学计算
-
-注意:
-- 系统会自动检测最兼容的Python环境
-- 如果openseespy不兼容，会自动fallback到subprocess调用
-- 云部署时请确保OpenSees可执行文件在PATH中
-""")
+            f.write(_USAGE_TEXT)
 
     def get_python_executable(self) -> str:
-        """获取要使用的Python可执行文件路径 - 自适应选择最佳环境"""
+        """获取要使用的Python可执行文件路径 - 自适应选择最佳环境（结果在进程内缓存）"""
+        # 并发任务同时请求时只解析一次
+        with self._resolve_lock:
+            if self._python_executable is None:
+                self._python_executable = self._resolve_python_executable()
+            return self._python_executable
+
+    def _resolve_python_executable(self) -> str:
+        """按优先级探测可用的Python环境"""
 
         # 优先级1: 检查虚拟环境
-        if os.path.exists(self.venv_dir):
-            if os.name == 'nt':  # Windows
-                venv_python = os.path.join(self.venv_dir, 'Scripts', 'python.exe')
-            else:  # Unix/Linux/Mac
-                venv_python = os.path.join(self.venv_dir, 'bin', 'python')
-
-            if os.path.exists(venv_python):
-                # 测试虚拟环境中的openseespy是否可用
-                if self._test_openseespy_compatibility(venv_python):
-                    return venv_python
-                else:
-                    print(f"⚠️  虚拟环境Python不兼容openseespy，寻找替代方案...")
-
-        # 优先级2: 测试各种Python环境的openseespy兼容性
-        python_candidates = [
-            'python',      # 可能是conda/miniconda
-            'python3',     # 系统Python3
-            '/usr/bin/python3',  # 系统默认Python3
-            '/opt/homebrew/bin/python3',  # Homebrew Python (ARM64 Mac)
-            '/usr/local/bin/python3',     # Homebrew Python (Intel Mac)
-        ]
+        venv_python = self._venv_python
+        if os.path.exists(venv_python):
+            # 测试虚拟环境中的openseespy是否可用
+            if self._test_openseespy_compatibility(venv_python):
+                return venv_python
+            else:
+                print(f"⚠️  虚拟环境Python不兼容openseespy，寻找替代方案...")
 
-        for python_exe in python_candidates:
-            if self._test_openseespy_compatibility(python_exe):
-                print(f"✅ 找到兼容的Python环境: {python_exe}")
-                return python_exe
+        # 优先级2: 测试各种Python环境的openseespy兼容性（setup_environment中已探测过的直接命中缓存）
+        python_exe = self._first_compatible(self.PYTHON_CANDIDATES)
+        if python_exe:
+            print(f"✅ 找到兼容的Python环境: {python_exe}")
+            return python_exe
 
         # 优先级3: 回退到系统Python（即使openseespy不可用）
         print("⚠️  未找到openseespy兼容环境，使用系统Python（将依赖subprocess fallback）")
         return 'python3'
 
-    def _test_openseespy_compatibility(self, python_exe: str) -> bool:
-        """测试指定Python环境中openseespy的兼容性"""
+    def _test_openseespy_compatibility(self, python_exe: str, refresh: bool = False) -> bool:
+        """测试指定Python环境中openseespy的兼容性（结果按解释器路径缓存，refresh=True时重新探测）"""
+        key = self._resolve_interpreter(python_exe)
+        if not refresh and key in self._compat_cache:
+            return self._compat_cache[key]
+
+        compatible = self._probe_openseespy(python_exe)
+        self._compat_cache[key] = compatible
+        return compatible
+
+    @staticmethod
+    def _resolve_interpreter(python_exe: str) -> str:
+        """将命令名解析为PATH中的绝对路径，找不到时按原样取绝对路径
+
+        不解析符号链接：虚拟环境的bin/python是指向基础解释器的符号链接，
+        但两者的sys.prefix与已安装的包不同，必须作为不同的解释器对待
+        """
+        return os.path.abspath(shutil.which(python_exe) or python_exe)
+
+    def _probe_openseespy(self, python_exe: str) -> bool:
+        """启动子进程实际导入openseespy"""
+        # 当前解释器中根本没有openseespy包时无需启动子进程；
+        # 找到包时仍需子进程验证（已安装但二进制不兼容的情况很常见）。
+        # 只比较不解析符号链接的路径：虚拟环境的python链接到基础解释器，但已安装的包不同
+        if self._resolve_interpreter(python_exe) == os.path.abspath(sys.executable):
+            if importlib.util.find_spec("openseespy") is None:
+                return False
+
         try:
             # 快速测试openseespy导入和基本操作
             test_cmd = [
@@ -211,6 +297,7 @@ class EnvironmentManager:
 
             result = subprocess.run(
                 test_cmd,
+                stdin=subprocess.DEVNULL,
                 capture_output=True,
                 text=True,
                 timeout=10
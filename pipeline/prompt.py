@@ -2,19 +2,41 @@
 根据sampler.py选择的用户意图和结构类型，通过llm.py调用gemini api扮演用户生成相应类别的一个prompt
 """
 # -*- coding: utf-8 -*-
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
-from llm import GeminiClient
-from typing import Optional
+if TYPE_CHECKING:
+    from llm import GeminiClient
 
 
 class PromptGenerator:
     """生成用户prompt"""
+
+    # 扮演用户的系统提示模板，只有意图与结构两处随任务变化
+    _SYSTEM_TEMPLATE = """你是一个需要结构分析的用户。请根据以下信息生成一个具体的结构分析需求prompt：
+
+用户意图：{intention}
+结构类型：{structure}
+
+请生成一个自然、具体的用户需求描述，要求：
+1. 语言自然，像真实用户提出的问题
+2. 包含具体的结构分析需求
+3. 描述清晰，包含必要的参数信息（如材料属性、几何尺寸、荷载等）
+4. 只输出用户需求描述，不要包含其他解释
+
+用户需求："""
     
-    def __init__(self, api_key: Optional[str] = None):
-        self.client = GeminiClient(api_key=api_key)
+    def __init__(self, api_key: Optional[str] = None, cache_prompts: bool = False, client: Optional["GeminiClient"] = None):
+        # 可传入共享的客户端，各阶段共用同一组并发与限速配额
+        if client is None:
+            # 延迟导入：只导入本模块时不加载HTTP客户端等依赖
+            from llm import GeminiClient
+            client = GeminiClient(api_key=api_key)
+        self.client = client
+        # 同一(意图, 结构)组合复用已生成的prompt，默认关闭（多次运行通常需要不同的用户需求）
+        self.cache_prompts = cache_prompts
+        self._prompts: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
     
     def generate(self, intention: str, structure: str) -> str:
         """
@@ -27,18 +49,14 @@ class PromptGenerator:
         Returns:
             生成的prompt字符串
         """
-        system_prompt = f"""你是一个需要结构分析的用户。请根据以下信息生成一个具体的结构分析需求prompt：
-
-用户意图：{intention}
-结构类型：{structure}
+        if self.cache_prompts:
+            with self._lock:
+                cached = self._prompts.get((intention, structure))
+            if cached is not None:
+                print(f"♻️ 复用已生成的用户Prompt: {structure}-{intention}")
+                return cached
 
-请生成一个自然、具体的用户需求描述，要求：
-1. 语言自然，像真实用户提出的问题
-2. 包含具体的结构分析需求
-3. 描述清晰，包含必要的参数信息（如材料属性、几何尺寸、荷载等）
-4. 只输出用户需求描述，不要包含其他解释
-
-用户需求："""
+        system_prompt = self._SYSTEM_TEMPLATE.format(intention=intention, structure=structure)
 
         prompt = self.client.call(system_prompt)
         
@@ -48,6 +66,9 @@ class PromptGenerator:
             print(f"{'='*60}")
             print(prompt)
             print(f"{'='*60}\n")
+            if self.cache_prompts:
+                with self._lock:
+                    prompt = self._prompts.setdefault((intention, structure), prompt)
             return prompt
         else:
             raise RuntimeError("生成prompt失败")
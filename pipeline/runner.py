@@ -0,0 +1,116 @@
+"""
+在forkserver派生的子进程中运行生成的openseespy程序，省去每次启动Python解释器的开销
+"""
+# -*- coding: utf-8 -*-
+import ast
+import multiprocessing
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import traceback
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+def can_run_in_process(python_exe: str) -> bool:
+    """
+    目标解释器就是当前解释器且平台支持forkserver时，才能复用当前进程的环境
+
+    forkserver会导入主模块，主模块必须用 if __name__ == "__main__" 保护入口，
+    否则整个主程序会在forkserver中被重新执行；没有保护时回退到子进程运行
+    """
+    if os.name != 'posix' or 'forkserver' not in multiprocessing.get_all_start_methods():
+        return False
+    # 不解析符号链接：虚拟环境的python链接到基础解释器，但sys.prefix与已安装的包不同
+    resolved = os.path.abspath(shutil.which(python_exe) or python_exe)
+    return resolved == os.path.abspath(sys.executable) and _main_is_guarded()
+
+
+@lru_cache(maxsize=1)
+def _main_is_guarded() -> bool:
+    """检查主模块顶层是否有 if __name__ == "__main__" 保护"""
+    path = getattr(sys.modules.get('__main__'), '__file__', None)
+    if not path:
+        # 交互式解释器或 python -c：forkserver不会导入主模块
+        return True
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return False
+    for node in tree.body:
+        if isinstance(node, ast.If) and isinstance(node.test, ast.Compare) \
+                and len(node.test.ops) == 1 and isinstance(node.test.ops[0], ast.Eq):
+            operands = {ast.unparse(node.test.left), ast.unparse(node.test.comparators[0])}
+            if operands in ({'__name__', "'__main__'"}, {'__name__', '"__main__"'}):
+                return True
+    return False
+
+
+def _get_context():
+    ctx = multiprocessing.get_context('forkserver')
+    # forkserver常驻并预先导入主模块和openseespy，每次运行的子进程从它fork，
+    # 无需重复导入；未安装openseespy时forkserver会忽略ImportError
+    ctx.set_forkserver_preload(['__main__', __name__, 'openseespy.opensees'])
+    return ctx
+
+
+def _execute(filepath: str, stdout_path: str, stderr_path: str):
+    """子进程入口：重定向标准输出/错误到文件后以__main__身份运行脚本"""
+    # 在文件描述符层面重定向，OpenSees C++层的输出同样能被捕获
+    for fd, path in ((1, stdout_path), (2, stderr_path)):
+        target = os.open(path, os.O_WRONLY | os.O_TRUNC)
+        os.dup2(target, fd)
+        os.close(target)
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+    sys.argv = [filepath]
+    try:
+        runpy.run_path(filepath, run_name="__main__")
+    except Exception:
+        exc_type, exc_value, tb = sys.exc_info()
+        # 去掉runner/runpy自身的调用帧，使错误输出与直接运行脚本一致
+        script_tb = tb
+        while script_tb is not None and script_tb.tb_frame.f_code.co_filename != filepath:
+            script_tb = script_tb.tb_next
+        traceback.print_exception(exc_type, exc_value, script_tb or tb)
+        sys.exit(1)
+
+
+def _read_output(path: str) -> Optional[str]:
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read()
+    return content if content else None
+
+
+def run_script(filepath: str, timeout: int = 60) -> Tuple[bool, Optional[str], Optional[str]]:
+    """
+    运行脚本
+
+    Returns:
+        (是否成功, 标准输出, 错误输出)
+    """
+    stdout_fd, stdout_path = tempfile.mkstemp(prefix="opensees_stdout_")
+    stderr_fd, stderr_path = tempfile.mkstemp(prefix="opensees_stderr_")
+    os.close(stdout_fd)
+    os.close(stderr_fd)
+
+    try:
+        process = _get_context().Process(target=_execute, args=(filepath, stdout_path, stderr_path))
+        process.start()
+        process.join(timeout)
+
+        if process.is_alive():
+            process.kill()
+            process.join()
+            return False, None, f"程序运行超时（{timeout}秒）"
+
+        return process.exitcode == 0, _read_output(stdout_path), _read_output(stderr_path)
+    finally:
+        for path in (stdout_path, stderr_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -3,29 +3,24 @@
 """
 import json
 import os
-import re
-from typing import Tuple, List, Optional, Dict, Set
+from collections import defaultdict
+from itertools import product
+from pathlib import Path
+from typing import Tuple, List, Optional, Dict, DefaultDict, Set
+from pipeline.translate import INTENTION_MAP, STRUCTURE_MAP, intention_to_english, structure_to_english, to_english
+
+
+def _load_json(path: str):
+    """按字节读取并解析JSON文件（json.loads自行识别编码，省去文本流的解码层）"""
+    return json.loads(Path(path).read_bytes())
 
 
 class Sampler:
     """从data文件夹中选择组合"""
     
-    # 中英文映射（与inference.py和postprocess.py保持一致）
-    INTENTION_MAP = {
-        "静力分析": "statics",
-        "模态分析": "modal",
-        "地震谱分析": "spectrum",
-        "时程分析": "timehistory"
-    }
-    
-    STRUCTURE_MAP = {
-        "框架": "frame",
-        "框架结构": "frame",
-        "剪力墙": "wall",
-        "剪力墙结构": "wall",
-        "框架剪力墙": "frame-wall",
-        "框架剪力墙结构": "frame-wall"
-    }
+    # 中英文映射（统一定义在pipeline/translate.py）
+    INTENTION_MAP = INTENTION_MAP
+    STRUCTURE_MAP = STRUCTURE_MAP
     
     def __init__(self, data_dir: str = "data", output_dir: str = "output"):
         self.data_dir = data_dir
@@ -35,18 +30,14 @@ class Sampler:
         self._run_count: Optional[int] = None
         self._plan: List[Tuple[str, str, int]] = []
         self._plan_index: int = 0
+        # _detect_existing_runs的结果及对应的目录修改时间，目录未变化时不再重新扫描
+        self._existing_runs: Optional[Dict[Tuple[str, str], Set[int]]] = None
+        self._existing_runs_mtime: Optional[Tuple[Optional[int], Optional[int]]] = None
         self._load_data()
     
     def _translate_to_english(self, structure: str, intention: str) -> Tuple[str, str]:
         """将中文结构类型和意图类型转换为英文"""
-        structure_key = structure.strip()
-        if structure_key.endswith("结构") and structure_key not in self.STRUCTURE_MAP:
-            structure_key = structure_key[:-2]
-        structure_en = self.STRUCTURE_MAP.get(structure_key, structure_key.lower().replace(" ", "-"))
-        
-        intention_key = intention.strip()
-        intention_en = self.INTENTION_MAP.get(intention_key, intention_key.lower().replace(" ", "-"))
-        return structure_en, intention_en
+        return to_english(structure, intention)
     
     def _detect_existing_runs(self) -> Dict[Tuple[str, str], Set[int]]:
         """
@@ -57,52 +48,54 @@ class Sampler:
         """
         existing_runs: Dict[Tuple[str, str], Set[int]] = {}
         
-        if not os.path.exists(self.output_dir):
+        if not os.path.isdir(self.output_dir):
             return existing_runs
-        
-        # 检查output文件夹中的文件夹
-        for item in os.listdir(self.output_dir):
-            item_path = os.path.join(self.output_dir, item)
-            if os.path.isdir(item_path) and item != "report":
-                # 匹配格式：{structure_en}-{intention_en}-{run_index}
-                # 从右往左匹配，确保最后一个数字是run_index
-                match = re.match(r'^(.+)-(\d+)$', item)
-                if match:
-                    prefix, run_index_str = match.groups()
-                    run_index = int(run_index_str)
-                    # 从prefix中分离structure和intention（最后一个连字符分割）
-                    last_dash = prefix.rfind('-')
-                    if last_dash > 0:
-                        structure_en = prefix[:last_dash]
-                        intention_en = prefix[last_dash+1:]
-                        key = (structure_en, intention_en)
-                        if key not in existing_runs:
-                            existing_runs[key] = set()
-                        existing_runs[key].add(run_index)
-        
-        # 检查report文件夹中的报告文件
+
+        # 新增/删除运行目录或报告文件会更新所在目录的修改时间
         report_dir = os.path.join(self.output_dir, "report")
-        if os.path.exists(report_dir):
-            for item in os.listdir(report_dir):
-                if item.endswith('.md'):
-                    # 匹配格式：{structure_en}-{intention_en}-{run_index}.md
-                    # 从右往左匹配，确保最后一个数字是run_index
-                    base_name = item[:-3]  # 移除 .md
-                    match = re.match(r'^(.+)-(\d+)$', base_name)
-                    if match:
-                        prefix, run_index_str = match.groups()
-                        run_index = int(run_index_str)
-                        # 从prefix中分离structure和intention（最后一个连字符分割）
-                        last_dash = prefix.rfind('-')
-                        if last_dash > 0:
-                            structure_en = prefix[:last_dash]
-                            intention_en = prefix[last_dash+1:]
-                            key = (structure_en, intention_en)
-                            if key not in existing_runs:
-                                existing_runs[key] = set()
-                            existing_runs[key].add(run_index)
+        mtimes = (self._mtime_ns(self.output_dir), self._mtime_ns(report_dir))
+        if self._existing_runs is not None and mtimes == self._existing_runs_mtime:
+            return self._existing_runs
         
+        runs: DefaultDict[Tuple[str, str], Set[int]] = defaultdict(set)
+
+        # 一次遍历output文件夹：运行目录直接记录，遇到report文件夹时就地扫描其中的报告文件
+        # （scandir的DirEntry自带文件类型，不必对每一项再stat）
+        with os.scandir(os.fsencode(self.output_dir)) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if entry.name != b"report":
+                    # 运行目录：{structure_en}-{intention_en}-{run_index}
+                    self._record(entry.name, runs)
+                    continue
+                with os.scandir(entry.path) as reports:
+                    for report in reports:
+                        # 报告文件：{structure_en}-{intention_en}-{run_index}.md
+                        if report.name.endswith(b'.md') and report.is_file():
+                            self._record(report.name[:-3], runs)
+        
+        existing_runs = dict(runs)
+        self._existing_runs = existing_runs
+        self._existing_runs_mtime = mtimes
         return existing_runs
+
+    @staticmethod
+    def _record(name: bytes, runs: DefaultDict[Tuple[str, str], Set[int]]):
+        """解析{structure_en}-{intention_en}-{run_index}格式的名称（按文件系统原始字节），从右往左分割"""
+        prefix, _, run_index = name.rpartition(b'-')
+        if not run_index.isdigit():
+            return
+        structure_en, _, intention_en = prefix.rpartition(b'-')
+        if structure_en:
+            runs[(os.fsdecode(structure_en), os.fsdecode(intention_en))].add(int(run_index))
+
+    @staticmethod
+    def _mtime_ns(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
     
     def _load_data(self):
         """加载intentions.json和structures.json"""
@@ -110,14 +103,16 @@ class Sampler:
         structures_path = os.path.join(self.data_dir, "structures.json")
         
         try:
-            with open(intentions_path, 'r', encoding='utf-8') as f:
-                self.intentions = json.load(f)
-            with open(structures_path, 'r', encoding='utf-8') as f:
-                self.structures = json.load(f)
+            self.intentions = _load_json(intentions_path)
+            self.structures = _load_json(structures_path)
         except FileNotFoundError as e:
             raise FileNotFoundError(f"数据文件未找到: {e}")
         except json.JSONDecodeError as e:
             raise ValueError(f"数据文件格式错误: {e}")
+
+        # 数据加载后不再变化，一次性算好与原列表一一对应的英文名称
+        self._intentions_en = [intention_to_english(intention) for intention in self.intentions]
+        self._structures_en = [structure_to_english(structure) for structure in self.structures]
     
     def _ask_run_count(self) -> int:
         """询问用户每个组合需要生成的次数"""
@@ -151,22 +146,26 @@ class Sampler:
         plan: List[Tuple[str, str, int]] = []
         skipped_count = 0
 
-        for structure in self.structures:
-            for intention in self.intentions:
-                # 转换为英文名称
-                structure_en, intention_en = self._translate_to_english(structure, intention)
-                key = (structure_en, intention_en)
-                
-                # 获取已存在的run_index
-                existing_indices = existing_runs.get(key, set())
-                
-                # 只生成缺失的run_index
-                for run_index in range(1, run_count + 1):
-                    if run_index not in existing_indices:
-                        plan.append((structure, intention, run_index))
-                    else:
-                        skipped_count += 1
-                        print(f"跳过已存在的组合: {structure_en}-{intention_en}-{run_index}")
+        run_indices = range(1, run_count + 1)
+
+        for (structure, structure_en), (intention, intention_en) in product(
+                zip(self.structures, self._structures_en),
+                zip(self.intentions, self._intentions_en)):
+            key = (structure_en, intention_en)
+            
+            # 获取已存在的run_index
+            existing_indices = existing_runs.get(key)
+            if not existing_indices:
+                plan.extend([(structure, intention, run_index) for run_index in run_indices])
+                continue
+            
+            # 只生成缺失的run_index
+            plan.extend([(structure, intention, run_index) for run_index in run_indices
+                         if run_index not in existing_indices])
+            for run_index in sorted(existing_indices):
+                if run_index in run_indices:
+                    skipped_count += 1
+                    print(f"跳过已存在的组合: {structure_en}-{intention_en}-{run_index}")
 
         if skipped_count > 0:
             print(f"\n已跳过 {skipped_count} 个已存在的组合。")
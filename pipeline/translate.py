@@ -0,0 +1,78 @@
+"""
+结构类型和用户意图的中英文名称转换（sampler、inference、postprocess共用）
+"""
+# -*- coding: utf-8 -*-
+import string
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Tuple
+
+
+# 中英文映射（只读视图：to_english的结果会被缓存，映射表不允许运行时修改）
+INTENTION_MAP = MappingProxyType({
+    "静力分析": "statics",
+    "模态分析": "modal",
+    "地震谱分析": "spectrum",
+    "时程分析": "timehistory"
+})
+
+STRUCTURE_MAP = MappingProxyType({
+    "框架": "frame",
+    "框架结构": "frame",
+    "剪力墙": "wall",
+    "剪力墙结构": "wall",
+    "框架剪力墙": "frame-wall",
+    "框架剪力墙结构": "frame-wall"
+})
+
+# 预先加入带/不带“结构”后缀的所有写法，已知名称只需一次字典查找
+_STRUCTURE_TABLE = {
+    **{key + "结构": value for key, value in STRUCTURE_MAP.items() if not key.endswith("结构")},
+    **STRUCTURE_MAP
+}
+
+
+# 小写化并把空格替换为连字符，一次translate完成（仅适用于ASCII文本）
+_SLUG_TABLE = str.maketrans({**{c: c.lower() for c in string.ascii_uppercase}, " ": "-"})
+
+
+def _slugify(name: str) -> str:
+    if name.isascii():
+        return name.translate(_SLUG_TABLE)
+    # 非ASCII字符的小写规则需要str.lower处理
+    return name.lower().replace(" ", "-")
+
+
+def structure_to_english(structure: str) -> str:
+    """将中文结构类型转换为英文"""
+    # 绝大多数输入本身就是规范名称，先直接查表，未命中再去除首尾空白
+    structure_en = _STRUCTURE_TABLE.get(structure)
+    if structure_en is not None:
+        return structure_en
+
+    structure_key = structure.strip()
+    structure_en = _STRUCTURE_TABLE.get(structure_key)
+    if structure_en is None:
+        if structure_key.endswith("结构"):
+            # 去掉后缀后可能仍是已知名称（如“框架结构结构”）
+            structure_key = structure_key[:-2]
+            structure_en = _STRUCTURE_TABLE.get(structure_key)
+        if structure_en is None:
+            structure_en = _slugify(structure_key)
+    return structure_en
+
+
+def intention_to_english(intention: str) -> str:
+    """将中文意图类型转换为英文"""
+    intention_en = INTENTION_MAP.get(intention)
+    if intention_en is not None:
+        return intention_en
+
+    intention_key = intention.strip()
+    return INTENTION_MAP.get(intention_key) or _slugify(intention_key)
+
+
+@lru_cache(maxsize=256)
+def to_english(structure: str, intention: str) -> Tuple[str, str]:
+    """将中文结构类型和意图类型转换为英文"""
+    return structure_to_english(structure), intention_to_english(intention)